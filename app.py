@@ -1,15 +1,123 @@
-from typing import Any, Dict, List, Type
-from flask import Flask, request, jsonify
+from typing import Annotated, Any, Dict, List, Optional, Type, Union, get_args, get_origin
+from quart import Quart, Response, request, jsonify, stream_with_context
+from quart.json.provider import DefaultJSONProvider
+from cachetools import TTLCache
 import instructor
 from config.setting import get_settings
-from openai import OpenAI
-from pydantic import BaseModel, Field
+from openai import AsyncOpenAI, NotFoundError
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints, ValidationError, conlist, create_model, field_validator
+from dataclasses import dataclass, field, fields
+import asyncio
+import functools
+import hashlib
+import httpx
 import json
 import logging
+import orjson
 import os
 import re
+import uvicorn
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider that encodes and decodes with orjson instead of the stdlib json module."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+app = Quart(__name__)
+app.json_provider_class = OrjsonProvider
+app.json = OrjsonProvider(app)
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Bounds in-flight LLM calls per worker; size it to the account's OpenAI rate limits.
+LLM_SEMAPHORE = asyncio.Semaphore(get_settings().openai.max_concurrent_requests)
+
+def response_cache(ttl: int = 86400, maxsize: int = 1024):
+    """Caches structured completions keyed by response model, messages and call parameters."""
+    cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs):
+            if kwargs.get("stream"):
+                return await func(self, response_model, messages, **kwargs)
+
+            payload = json.dumps(
+                {"response_model": response_model.__name__, "messages": messages, "params": kwargs},
+                sort_keys=True,
+            )
+            key = hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+            cached = cache.get(key)
+            if cached is not None:
+                return response_model.model_validate_json(cached)
+
+            completion = await func(self, response_model, messages, **kwargs)
+            cache[key] = completion.model_dump_json()
+            return completion
+
+        return wrapper
+
+    return decorator
+
+def _strip_constraints(annotation: Any) -> Any:
+    """Removes Annotated constraints from a type, including those nested inside List[...]."""
+    if get_origin(annotation) is Annotated:
+        return _strip_constraints(get_args(annotation)[0])
+    args = get_args(annotation)
+    if args:
+        return get_origin(annotation)[tuple(_strip_constraints(arg) for arg in args)]
+    return annotation
+
+@functools.cache
+def streaming_model(response_model: Type[BaseModel]) -> Type[BaseModel]:
+    """Copy of a response model without length or pattern constraints, used only to parse partial objects mid-stream."""
+    return create_model(
+        response_model.__name__,
+        __doc__=response_model.__doc__,
+        **{
+            name: (_strip_constraints(model_field.annotation), Field(..., description=model_field.description))
+            for name, model_field in response_model.model_fields.items()
+        },
+    )
+
+@functools.cache
+def tool_spec(response_model: Type[BaseModel]) -> Dict[str, Any]:
+    """OpenAI function tool for a response model, built from its JSON schema once per model."""
+    if not issubclass(response_model, instructor.OpenAISchema):
+        response_model = instructor.openai_schema(response_model)
+    return {"type": "function", "function": response_model.openai_schema}
+
+def build_http_client() -> httpx.AsyncClient:
+    """HTTP/2 client with a keep-alive pool, so concurrent completions share TLS sessions."""
+    return httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100, keepalive_expiry=60),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+
+def _jsonl(text: str) -> List[Dict[str, Any]]:
+    """Parses the non-blank lines of a JSONL file."""
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
 
-app = Flask(__name__)
+class LLMResponseError(RuntimeError):
+    """Raised when the model replies without a usable tool call (refusal, plain text or truncation)."""
+
+def check_tool_reply(finish_reason: Optional[str], refusal: Optional[str], tool_called: bool, tool_name: str) -> None:
+    """Raises LLMResponseError for replies that re-asking with the same parameters cannot fix."""
+    if finish_reason == "length":
+        raise LLMResponseError("Completion was cut off by max_tokens before the tool call finished")
+    if refusal:
+        raise LLMResponseError(f"Model refused the request: {refusal}")
+    if not tool_called:
+        raise LLMResponseError(f"Model replied without calling {tool_name}")
+
+# Batches in these states will not produce any more output
+BATCH_TERMINAL_STATUSES = frozenset({"completed", "expired", "cancelled", "failed"})
 
 class LLMFactory:
     def __init__(self, provider: str):
@@ -17,9 +125,15 @@ class LLMFactory:
         self.settings = getattr(get_settings(), provider)
         self.client = self._initialize_client()
 
+    @classmethod
+    @functools.cache
+    def get(cls, provider: str) -> "LLMFactory":
+        """Returns the process-wide factory for a provider, creating its client on first use."""
+        return cls(provider)
+
     def _initialize_client(self) -> Any:
         client_initializers = {
-            "openai": lambda s: instructor.from_openai(OpenAI(api_key=s.api_key))
+            "openai": lambda s: AsyncOpenAI(api_key=s.api_key, http_client=build_http_client())
         }
 
         initializer = client_initializers.get(self.provider)
@@ -27,21 +141,205 @@ class LLMFactory:
             return initializer(self.settings)
         raise ValueError(f"Unsupported LLM provider: {self.provider}")
 
-    def create_completion(
+    @response_cache(ttl=86400)
+    async def create_completion(
         self, response_model: Type[BaseModel], messages: List[Dict[str, str]], **kwargs
     ) -> Any:
         completion_params = {
             "model": kwargs.get("model", self.settings.default_model),
             "temperature": kwargs.get("temperature", self.settings.temperature),
-            "max_retries": kwargs.get("max_retries", self.settings.max_retries),
             "max_tokens": kwargs.get("max_tokens", self.settings.max_tokens),
-            "response_model": response_model,
             "messages": messages,
         }
-        return self.client.chat.completions.create(**completion_params)
+        # The pinned SDK predates the prompt_cache_key argument, so send it as a raw body field
+        prompt_cache_key = kwargs.get("prompt_cache_key")
+        if prompt_cache_key:
+            completion_params["extra_body"] = {"prompt_cache_key": prompt_cache_key}
+        if kwargs.get("stream"):
+            return self._stream_completion(response_model, completion_params)
+        max_retries = kwargs.get("max_retries", self.settings.max_retries)
+        async with LLM_SEMAPHORE:
+            return await self._tool_completion(response_model, completion_params, max_retries)
+
+    @staticmethod
+    def _tool_params(response_model: Type[BaseModel], completion_params: Dict[str, Any]) -> Dict[str, Any]:
+        """Raw chat completion parameters that force a call to the model's prebuilt tool."""
+        params = {key: value for key, value in completion_params.items() if value is not None}
+        tool = tool_spec(response_model)
+        params["tools"] = [tool]
+        params["tool_choice"] = {"type": "function", "function": {"name": tool["function"]["name"]}}
+        params["messages"] = list(params["messages"])
+        return params
+
+    async def _tool_completion(
+        self, response_model: Type[BaseModel], completion_params: Dict[str, Any], max_retries: int
+    ):
+        """Forces a call to the model's prebuilt tool and validates the arguments, re-asking on errors.
+
+        Mirrors instructor's TOOLS mode without re-deriving the tool schema on every call.
+        """
+        params = self._tool_params(response_model, completion_params)
+        tool = params["tools"][0]
+
+        # Same semantics as instructor: max_retries is the total number of attempts
+        attempts = max(max_retries, 1)
+        for attempt in range(1, attempts + 1):
+            response = await self.client.chat.completions.create(**params)
+            choice = response.choices[0]
+            message = choice.message
+            check_tool_reply(choice.finish_reason, message.refusal, bool(message.tool_calls), tool["function"]["name"])
+            try:
+                return response_model.model_validate_json(message.tool_calls[0].function.arguments)
+            except ValidationError as e:
+                if attempt == attempts:
+                    raise
+                params["messages"].append(message.model_dump(exclude_none=True))
+                params["messages"].extend(
+                    {
+                        "role": "tool",
+                        "tool_call_id": tool_call.id,
+                        "name": tool_call.function.name,
+                        "content": f"Validation Error found:\n{e}\nRecall the function correctly, fix the errors",
+                    }
+                    for tool_call in message.tool_calls
+                )
+
+    async def _stream_completion(self, response_model: Type[BaseModel], completion_params: Dict[str, Any]):
+        """Streams the forced tool call, yielding ("partial", obj) pairs and finally ("final", obj).
+
+        The model is sent the full tool schema; only the parsing of partial objects is relaxed.
+        The final object is validated against response_model, so a ValidationError or
+        LLMResponseError is raised instead of a "final" pair when the completed call is unusable.
+        """
+        params = self._tool_params(response_model, completion_params)
+        params["stream"] = True
+        tool_name = params["tools"][0]["function"]["name"]
+        partial_model = instructor.Partial[streaming_model(response_model)]
+        arguments: List[str] = []
+        refusal: List[str] = []
+        finish_reason = None
+
+        async def argument_chunks(stream):
+            nonlocal finish_reason
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                finish_reason = choice.finish_reason or finish_reason
+                if choice.delta.refusal:
+                    refusal.append(choice.delta.refusal)
+                for tool_call in choice.delta.tool_calls or []:
+                    if tool_call.function and tool_call.function.arguments:
+                        arguments.append(tool_call.function.arguments)
+                        yield tool_call.function.arguments
+
+        async with LLM_SEMAPHORE:
+            stream = await self.client.chat.completions.create(**params)
+            async for partial in partial_model.model_from_chunks_async(argument_chunks(stream)):
+                yield "partial", partial
+
+        check_tool_reply(finish_reason, "".join(refusal), bool(arguments), tool_name)
+        yield "final", response_model.model_validate_json("".join(arguments))
+
+    async def submit_batch(
+        self,
+        response_model: Type[BaseModel],
+        messages_list: List[List[Dict[str, str]]],
+        models: Optional[List[str]] = None,
+        **kwargs,
+    ) -> str:
+        """Submits one chat completion per messages list through the OpenAI Batch API.
+
+        models, when given, picks the model for each messages list at the same position.
+        """
+        tool = tool_spec(response_model)
+        default_model = kwargs.get("model", self.settings.default_model)
+        models = models or [default_model] * len(messages_list)
+        body = {
+            "temperature": kwargs.get("temperature", self.settings.temperature),
+            "tools": [tool],
+            "tool_choice": {"type": "function", "function": {"name": tool["function"]["name"]}},
+        }
+        max_tokens = kwargs.get("max_tokens", self.settings.max_tokens)
+        if max_tokens is not None:
+            body["max_tokens"] = max_tokens
+
+        lines = [
+            json.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {**body, "model": model, "messages": messages},
+            })
+            for i, (messages, model) in enumerate(zip(messages_list, models))
+        ]
+
+        batch_file = await self.client.files.create(
+            file=("batch.jsonl", "\n".join(lines).encode()), purpose="batch"
+        )
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+        )
+        return batch.id
+
+    async def retrieve_batch(self, batch_id: str, response_model: Type[BaseModel]) -> Dict[str, Any]:
+        """Returns the batch status and, once it has finished, every request's parsed result or error.
+
+        Results are also returned for expired and cancelled batches, covering the requests that
+        finished in time. A completed batch reports "completed", "completed_with_errors" when any
+        request failed, or "completed_empty" when OpenAI produced neither an output nor an error file.
+        """
+        batch = await self.client.batches.retrieve(batch_id)
+        if batch.status not in BATCH_TERMINAL_STATUSES:
+            return {"status": batch.status, "results": None}
+
+        # Requests rejected by the Batch API itself only appear in the error file
+        results = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                content = await self.client.files.content(file_id)
+                results.extend(self._batch_result(item, response_model) for item in _jsonl(content.text))
+
+        results.sort(key=lambda r: int(r["custom_id"]))
+        status = batch.status
+        if status == "completed":
+            if not results:
+                status = "completed_empty"
+            elif any("error" in r for r in results):
+                status = "completed_with_errors"
+        return {"status": status, "results": results}
+
+    @staticmethod
+    def _batch_result(item: Dict[str, Any], response_model: Type[BaseModel]) -> Dict[str, Any]:
+        """Parses one output or error file line into the response model, or into its error."""
+        response = item.get("response") or {}
+        body = response.get("body") or {}
+        if item.get("error") or response.get("status_code") != 200:
+            return {"custom_id": item["custom_id"], "error": item.get("error") or body.get("error")}
+
+        try:
+            choice = body["choices"][0]
+            message = choice["message"]
+            tool_calls = message.get("tool_calls")
+            check_tool_reply(
+                choice.get("finish_reason"), message.get("refusal"), bool(tool_calls),
+                tool_spec(response_model)["function"]["name"],
+            )
+            completion = response_model.model_validate_json(tool_calls[0]["function"]["arguments"])
+        except (LLMResponseError, ValidationError) as e:
+            return {"custom_id": item["custom_id"], "error": str(e)}
+        return {"custom_id": item["custom_id"], **completion.model_dump()}
+
+# A single hashtag word, e.g. "#B2BMarketing"
+Hashtag = Annotated[str, StringConstraints(pattern=r"^#\w+$")]
 
 class SocialMediaPost(BaseModel):
     """Social media post generated from AI transcript and topic"""
+    # Trim stray whitespace before the length checks so it never costs a retry
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     title: str = Field(
         ...,
         max_length=70,
@@ -73,10 +371,8 @@ class SocialMediaPost(BaseModel):
         )
     )
     
-    hashtags: List[str] = Field(
+    hashtags: conlist(Hashtag, min_length=3, max_length=3) = Field(
         ...,
-        min_items=3,
-        max_items=3,
         description=(
             "EXACTLY 3 HASHTAGS:\n"
             "1. #broad_subject (common)\n"
@@ -87,6 +383,8 @@ class SocialMediaPost(BaseModel):
    
 class BlogPost(BaseModel):
     """SEO-optimized blog post generated from AI transcript and topic"""
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     title: str = Field(
         ...,
         max_length=120,
@@ -133,203 +431,342 @@ class BlogPost(BaseModel):
         )
     )
     
-    hashtags: List[str] = Field(
+    hashtags: conlist(Hashtag, min_length=3, max_length=5) = Field(
         ...,
-        min_items=3,
-        max_items=5,
         description=(
             "3-5 HASHTAGS FOR SOCIAL SHARING:\n"
             "Mix of industry topics and specific terms"
         )
     )
 
-def sanitize_json(json_data):
-    """Cleans keys and values in JSON by removing problematic characters."""
-    sanitized_data = {}
-
-    for key, value in json_data.items():
-        # Sanitize key (remove quotes and backticks)
-        new_key = key.replace("'", "").replace('"', "").replace("`", "")
-
-        # Sanitize value if it's a string
-        if isinstance(value, str):
-            value = re.sub(r'[\n\r\t]', ' ', value)  # Replace newlines/tabs with spaces
-            value = re.sub(r'[^\x20-\x7E]', '', value)  # Remove non-printable special characters
-            value = value.replace('\\', '\\\\')  # Escape backslashes
-            value = value.replace('"', '\\"')  # Escape double quotes
-            value = value.strip()  # Remove leading/trailing spaces
-
-        sanitized_data[new_key] = value
-
-    return sanitized_data
-
-def PostGenerator(request_data: dict):  
-     # Sanitize entire request data (keys + values)
-    sanitized_data = sanitize_json(request_data)
-
-    system_content = f'''
+class GenerateRequest(BaseModel):
+    """Required generation inputs; every other request field is passed through untouched."""
+    model_config = ConfigDict(extra="allow", populate_by_name=True)
+
+    transcript: str = Field(..., alias="2.AI Transcript Rough")
+    topic: str = Field(..., alias="12.Topic Name")
+    model_override: Optional[str] = None
+
+    @field_validator("model_override")
+    @classmethod
+    def check_model_override(cls, value: Optional[str]) -> Optional[str]:
+        allowed = get_settings().openai.allowed_models
+        if value and value not in allowed:
+            raise ValueError(f"model_override must be one of: {', '.join(sorted(allowed))}")
+        return value
+
+def invalid_request_response(*errors: ValidationError, indexes: Optional[List[int]] = None):
+    """Builds the 400 response for request bodies that failed GenerateRequest validation.
+
+    For batch requests, each error's loc is prefixed with the index of the item it belongs to.
+    """
+    details = []
+    for position, error in enumerate(errors):
+        for detail in error.errors(include_url=False, include_context=False, include_input=False):
+            if indexes is not None:
+                detail["loc"] = (indexes[position], *detail["loc"])
+            details.append(detail)
+    return jsonify({"error": "Invalid request", "details": details}), 400
+
+# Shared across requests: one client (and its connection pool) per process
+LLM = LLMFactory.get("openai")
+
+# Static instructions go first in every system prompt so that OpenAI's automatic
+# prompt caching can reuse the shared token prefix across creators and requests.
+STATIC_SYSTEM_PREAMBLE = '''
         You are an expert senior copywriter and social media marketer who helps business leaders and subject matter experts convert their spoken words into polished, 
         clear and articulate text content. Your core function is to turn AI transcripts from recorded calls into social media marketing posts that establish the writer 
         as a thought leader in their space, educate customers and prospects, and/or market the company the leader or subject matter expert works for.
-     
-        <Context>
-            Please review the various pieces of context below on the creator, their company, their brand, their social post style guide, and more.
 
+        Please review the various pieces of context below on the creator, their company, their brand, their social post style guide, and more.
+'''
+
+STATIC_BLOG_SYSTEM_PREAMBLE = '''
+        You are an expert content strategist and SEO specialist who helps convert spoken-word transcripts into 
+        professional, optimized blog posts. Your goal is to create long-form content that ranks well in search engines
+        while maintaining natural readability and thought leadership.
+
+        Follow these structural requirements:
+        - Start with SEO frontmatter section
+        - Use proper heading hierarchy (H1 > H2 > H3)
+        - Include at least one bulleted list
+        - Keep paragraphs under 5 lines
+        - Use transitional phrases between sections
+        - Include natural keyword placement
+        - Add 3-5 relevant hashtags at end
+'''
+
+@dataclass(slots=True)
+class PromptContext:
+    """Prompt inputs read out of the sanitized request once; each field's metadata names its request key."""
+    company_name: str = field(default="", metadata={"key": "6.Name"})
+    company_description: str = field(default="", metadata={"key": "6.Company Description"})
+    creator_name: str = field(default="", metadata={"key": "11.Full Name"})
+    creator_bio: str = field(default="", metadata={"key": "11.Bio"})
+    brand_values: str = field(default="", metadata={"key": "7.Brand Values"})
+    brand_personalities: str = field(default="", metadata={"key": "7.Brand Personalities"})
+    tone_of_voice: str = field(default="", metadata={"key": "7.Tone of Voice Principles"})
+    language_dos: str = field(default="", metadata={"key": "7.Language Dos"})
+    language_donts: str = field(default="", metadata={"key": "7.Language Donts"})
+    audience_adaptations: str = field(default="", metadata={"key": "7.Audience Adaptations"})
+    on_brand_examples: str = field(default="", metadata={"key": "7.On Brand Examples"})
+    off_brand_examples: str = field(default="", metadata={"key": "7.Off Brand (Bad) Examples"})
+    narrative_style: str = field(default="", metadata={"key": "7.Narrative and Storytelling Style"})
+    key_messages: str = field(default="", metadata={"key": "7.Key Messages"})
+    social_style_guide: str = field(default="", metadata={"key": "7.Social Post Writing Style Guide"})
+    long_form_style_guide: str = field(default="", metadata={"key": "7.Long Form Writing Style Guide"})
+    audience: Any = field(default="", metadata={"key": "14.array"})
+    solutions: Any = field(default="", metadata={"key": "13.array"})
+    social_sample_1: str = field(default="", metadata={"key": "11.Social Post Sample 1"})
+    social_sample_2: str = field(default="", metadata={"key": "11.Social Post Sample 2"})
+    social_sample_3: str = field(default="", metadata={"key": "11.Social Post Sample 3"})
+    long_form_sample_1: str = field(default="", metadata={"key": "11.Long Form Text Sample 1"})
+    long_form_sample_2: str = field(default="", metadata={"key": "11.Long Form Text Sample 2"})
+    long_form_sample_3: str = field(default="", metadata={"key": "11.Long Form Text Sample 3"})
+    transcript: str = field(default="", metadata={"key": "2.AI Transcript Rough"})
+    topic: str = field(default="", metadata={"key": "12.Topic Name"})
+
+    @classmethod
+    def from_request(cls, sanitized_data: dict) -> "PromptContext":
+        return cls(**{name: sanitized_data.get(key, "") for name, key in _PROMPT_CONTEXT_KEYS})
+
+_PROMPT_CONTEXT_KEYS = tuple((f.name, f.metadata["key"]) for f in fields(PromptContext))
+
+# Prompt templates are built once at import and filled with str.format per request;
+# placeholders read attributes of the request's PromptContext.
+_SOCIAL_SYS_TMPL = STATIC_SYSTEM_PREAMBLE + '''
+        <Context>
             <company_name>
-            Company Name: {sanitized_data.get("6.Name", "")}
+            Company Name: {ctx.company_name}
             </company_name>
 
             <company_description>
-            Company Description: {sanitized_data.get("6.Company Description", "")}
+            Company Description: {ctx.company_description}
             </company_description>
 
             <creator_name>
-            Creator Name: {sanitized_data.get("11.Full Name", "")}
+            Creator Name: {ctx.creator_name}
             </creator_name>
 
             Please read the bio below of the creator who will be seen as the author of this social post. This creator is also the person who recorded what is in the AI transcript.
 
             <creator_bio>
-            Creator Bio: {sanitized_data.get("11.Bio", "")}
+            Creator Bio: {ctx.creator_bio}
             </creator_bio>
 
-            <optional_context>
-            The items below may or may not have values. If they're empty just ignore them when creating the social post text.
-
-            Brand Values: {sanitized_data.get("7.Brand Values", "")}
-            Brand Personalities: {sanitized_data.get("7.Brand Personalities", "")}
-            Tone of Voice Principles: {sanitized_data.get("7.Tone of Voice Principles", "")}
-            Language Dos: {sanitized_data.get("7.Language Dos", "")}
-            Language Donts: {sanitized_data.get("7.Language Donts", "")}
-            Audience Adapatations: {sanitized_data.get("7.Audience Adaptations", "")}
-            On Brand Examples: {sanitized_data.get("7.On Brand Examples", "")}
-            Off Brand Examples: {sanitized_data.get("7.Off Brand (Bad) Examples", "")}
-            Narrative Style: {sanitized_data.get("7.Narrative and Storytelling Style", "")}
-            Key Messages: {sanitized_data.get("7.Key Messages", "")}
-            Social Post Style Guide: {sanitized_data.get("7.Social Post Writing Style Guide", "")}
-            Audience Information: {sanitized_data.get("14.array", "")}
-            Solutions Information: {sanitized_data.get("13.array", "")}
-            </optional_context>
+{optional_context}
             </context>
             
             <examples>
             <example1>
-            {sanitized_data.get("11.Social Post Sample 1", "")}
+            {ctx.social_sample_1}
             </example1>
             <example2>
-            {sanitized_data.get("11.Social Post Sample 2", "")}
+            {ctx.social_sample_2}
             </example2>
             <example3>
-            {sanitized_data.get("11.Social Post Sample 3", "")}
+            {ctx.social_sample_3}
             </example3>
             </examples>
-    '''
+'''
 
-    user_content = f'''
+_SOCIAL_USER_TMPL = '''
         Please write a social media post using your system instructions and given the AI transcript and topic below:
 
         <ai_transcript>
-        AI Transcript: {sanitized_data.get("2.AI Transcript Rough", "")}
+        AI Transcript: {ctx.transcript}
         </ai_transcript>
         <topic>
-        Topic Name: {sanitized_data.get("12.Topic Name", "")}
+        Topic Name: {ctx.topic}
         </topic>
-    '''
-
-    messages = [
-        {"role": "system", "content": system_content},
-        {"role": "user", "content": user_content}
-    ]
+'''
 
-    # Generate the List
-    llm = LLMFactory("openai")
-    completion = llm.create_completion(response_model=SocialMediaPost, messages=messages)
-
-    return {
-        "title": completion.title,
-        "body": completion.body,
-        "hashtags": completion.hashtags,
-    }
-
-def BlogPostGenerator(request_data: dict):
-     # Sanitize entire request data (keys + values)
-    sanitized_data = sanitize_json(request_data)
-
-    system_content = f'''
-        You are an expert content strategist and SEO specialist who helps convert spoken-word transcripts into 
-        professional, optimized blog posts. Your goal is to create long-form content that ranks well in search engines
-        while maintaining natural readability and thought leadership.
 
+_BLOG_SYS_TMPL = STATIC_BLOG_SYSTEM_PREAMBLE + '''
         <Context>
             <company_name>
-            Company Name: {sanitized_data.get("6.Name", "")}
+            Company Name: {ctx.company_name}
             </company_name>
 
             <company_description>
-            Company Description: {sanitized_data.get("6.Company Description", "")}
+            Company Description: {ctx.company_description}
             </company_description>
 
             <creator_name>
-            Creator Name: {sanitized_data.get("11.Full Name", "")}
+            Creator Name: {ctx.creator_name}
             </creator_name>
 
             <creator_bio>
-            Creator Bio: {sanitized_data.get("11.Bio", "")}
+            Creator Bio: {ctx.creator_bio}
             </creator_bio>
 
             <style_guide>
-            Long Form Style Guide: {sanitized_data.get("7.Long Form Writing Style Guide", "")}
+            Long Form Style Guide: {ctx.long_form_style_guide}
             </style_guide>
 
-            <optional_context>
-            Brand Values: {sanitized_data.get("7.Brand Values", "")}
-            Tone Guidelines: {sanitized_data.get("7.Tone of Voice Principles", "")}
-            Audience: {sanitized_data.get("14.array", "")}
-            Solutions: {sanitized_data.get("13.array", "")}
-            </optional_context>
+{optional_context}
         </context>
 
         <examples>
         <example1>
-        {sanitized_data.get("11.Long Form Text Sample 1", "")}
+        {ctx.long_form_sample_1}
         </example1>
         <example2>
-        {sanitized_data.get("11.Long Form Text Sample 2", "")}
+        {ctx.long_form_sample_2}
         </example2>
         <example3>
-        {sanitized_data.get("11.Long Form Text Sample 3", "")}
+        {ctx.long_form_sample_3}
         </example3>
         </examples>
-    '''
+'''
 
-    user_content = f'''
+_BLOG_USER_TMPL = '''
         Create an SEO-optimized blog post from this transcript and topic:
 
         <ai_transcript>
-        {sanitized_data.get("2.AI Transcript Rough", "")}
+        {ctx.transcript}
         </ai_transcript>
 
         <topic>
-        {sanitized_data.get("12.Topic Name", "")}
+        {ctx.topic}
         </topic>
+'''
+
+# (label, PromptContext attribute) pairs for each template's <optional_context> block
+_SOCIAL_OPTIONAL_CONTEXT = (
+    ("Brand Values", "brand_values"),
+    ("Brand Personalities", "brand_personalities"),
+    ("Tone of Voice Principles", "tone_of_voice"),
+    ("Language Dos", "language_dos"),
+    ("Language Donts", "language_donts"),
+    ("Audience Adapatations", "audience_adaptations"),
+    ("On Brand Examples", "on_brand_examples"),
+    ("Off Brand Examples", "off_brand_examples"),
+    ("Narrative Style", "narrative_style"),
+    ("Key Messages", "key_messages"),
+    ("Social Post Style Guide", "social_style_guide"),
+    ("Audience Information", "audience"),
+    ("Solutions Information", "solutions"),
+)
+
+_BLOG_OPTIONAL_CONTEXT = (
+    ("Brand Values", "brand_values"),
+    ("Tone Guidelines", "tone_of_voice"),
+    ("Audience", "audience"),
+    ("Solutions", "solutions"),
+)
+
+def render_optional_context(ctx: PromptContext, labels: tuple, indent: str = " " * 12) -> str:
+    """Renders the <optional_context> block with only the fields that have values, or nothing if none do."""
+    lines = []
+    for label, attr in labels:
+        value = getattr(ctx, attr)
+        if isinstance(value, str):
+            value = value.strip()
+        if value:
+            lines.append(f"{indent}{label}: {value}")
+    if not lines:
+        return ""
+    return f"{indent}<optional_context>\n" + "\n".join(lines) + f"\n{indent}</optional_context>"
+
+# Deletion table for key sanitization (quotes and backticks), applied in a single C-level pass
+_SANITIZE = str.maketrans("", "", "'\"`")
+
+def sanitize_value(value):
+    """Cleans a single JSON value; non-string values are returned unchanged."""
+    if isinstance(value, str):
+        value = re.sub(r'[\n\r\t]', ' ', value)  # Replace newlines/tabs with spaces
+        value = re.sub(r'[^\x20-\x7E]', '', value)  # Remove non-printable special characters
+        value = value.replace('\\', '\\\\')  # Escape backslashes
+        value = value.replace('"', '\\"')  # Escape double quotes
+        value = value.strip()  # Remove leading/trailing spaces
+    return value
 
-        Follow these structural requirements:
-        - Start with SEO frontmatter section
-        - Use proper heading hierarchy (H1 > H2 > H3)
-        - Include at least one bulleted list
-        - Keep paragraphs under 5 lines
-        - Use transitional phrases between sections
-        - Include natural keyword placement
-        - Add 3-5 relevant hashtags at end
-    '''
+def sanitize_json(json_data):
+    """Cleans keys and values in JSON by removing problematic characters."""
+    return {key.translate(_SANITIZE): sanitize_value(value) for key, value in json_data.items()}
+
+def build_post_messages(ctx: PromptContext) -> List[Dict[str, str]]:
+    """Builds the chat messages for a social media post from the request's prompt context."""
+    system_content = _SOCIAL_SYS_TMPL.format(
+        ctx=ctx, optional_context=render_optional_context(ctx, _SOCIAL_OPTIONAL_CONTEXT)
+    )
+    user_content = _SOCIAL_USER_TMPL.format(ctx=ctx)
+
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": user_content}
+    ]
+
+# Social posts below either threshold go to the provider's smaller model
+SMALL_MODEL_MAX_PROMPT_TOKENS = 2000
+SMALL_MODEL_MAX_TRANSCRIPT_CHARS = 3000
+
+def select_post_model(sanitized_data: dict, messages: List[Dict[str, str]]) -> str:
+    """Routes light social post requests to the smaller model, honouring a validated model_override."""
+    override = sanitized_data.get("model_override")
+    if override:
+        return override
+
+    approx_tokens = sum(len(message["content"]) for message in messages) // 4
+    transcript = sanitized_data.get("2.AI Transcript Rough", "")
+    if approx_tokens < SMALL_MODEL_MAX_PROMPT_TOKENS or len(transcript) < SMALL_MODEL_MAX_TRANSCRIPT_CHARS:
+        return LLM.settings.small_model
+    return LLM.settings.default_model
+
+async def PostGenerator(sanitized_data: dict):  
+    # The routes sanitize the request once, before validation
+    ctx = PromptContext.from_request(sanitized_data)
+    messages = build_post_messages(ctx)
+
+    # Generate the List
+    completion = await LLM.create_completion(
+        response_model=SocialMediaPost,
+        messages=messages,
+        model=select_post_model(sanitized_data, messages),
+        prompt_cache_key=ctx.creator_name,
+    )
+
+    return {
+        "title": completion.title,
+        "body": completion.body,
+        "hashtags": completion.hashtags,
+    }
+
+async def PostStreamGenerator(sanitized_data: dict):
+    """Yields {"type": "partial" | "final", "post": ...} records while the completion streams in."""
+    ctx = PromptContext.from_request(sanitized_data)
+    messages = build_post_messages(ctx)
+
+    partials = await LLM.create_completion(
+        response_model=SocialMediaPost,
+        messages=messages,
+        model=select_post_model(sanitized_data, messages),
+        prompt_cache_key=ctx.creator_name,
+        stream=True,
+    )
+    async for kind, post in partials:
+        yield {"type": kind, "post": post.model_dump()}
+
+async def BlogPostGenerator(sanitized_data: dict):
+    # The routes sanitize the request once, before validation
+    ctx = PromptContext.from_request(sanitized_data)
+    system_content = _BLOG_SYS_TMPL.format(
+        ctx=ctx, optional_context=render_optional_context(ctx, _BLOG_OPTIONAL_CONTEXT)
+    )
+    user_content = _BLOG_USER_TMPL.format(ctx=ctx)
 
     messages = [
         {"role": "system", "content": system_content},
         {"role": "user", "content": user_content}
     ]
 
-    llm = LLMFactory("openai")
-    completion = llm.create_completion(response_model=BlogPost, messages=messages)
+    completion = await LLM.create_completion(
+        response_model=BlogPost,
+        messages=messages,
+        model=sanitized_data.get("model_override") or LLM.settings.default_model,
+        prompt_cache_key=ctx.creator_name,
+    )
 
     return {
         "title": completion.title,
@@ -338,73 +775,156 @@ def BlogPostGenerator(request_data: dict):
     }
  
 @app.route('/generate_blog', methods=['POST'])
-def generate_blog():
+async def generate_blog():
     try:
         # Ensure request is JSON
         if not request.is_json:
             return jsonify({"error": "Invalid JSON format"}), 400
 
-        raw_data = request.get_json(force=True)  # Use force=True to handle potential parsing issues
+        raw_data = orjson.loads(await request.get_data())
         if not isinstance(raw_data, dict):
             return jsonify({"error": "Invalid JSON payload"}), 400
 
-        # Log raw request data for debugging
-        logging.info(f"Raw Request Data:\n{json.dumps(raw_data, indent=2, ensure_ascii=False)}")
+        # Log raw request data for debugging; %r is only formatted when DEBUG is enabled
+        logger.debug("Raw request data: %r", raw_data)
 
         # Sanitize the data
         cleaned_data = sanitize_json(raw_data)
 
         # Log sanitized data
-        logging.info(f"Sanitized Data:\n{json.dumps(cleaned_data, indent=2, ensure_ascii=False)}")
+        logger.debug("Sanitized data: %r", cleaned_data)
 
         # Required field validation
-        required_fields = ["2.AI Transcript Rough", "12.Topic Name"]
-        for field in required_fields:
-            if field not in cleaned_data:
-                return jsonify({"error": f"Missing required field: {field}"}), 400
+        try:
+            payload = GenerateRequest.model_validate(cleaned_data).model_dump(by_alias=True)
+        except ValidationError as e:
+            return invalid_request_response(e)
 
-        result = BlogPostGenerator(cleaned_data)
+        result = await BlogPostGenerator(payload)
         return jsonify(result)
 
     except json.JSONDecodeError as e:
-        logging.error(f"JSON Decoding Error: {str(e)}")
+        logger.warning("JSON decoding error: %s", e)
         return jsonify({"error": "Malformed JSON"}), 400
-    except Exception as e:
-        logging.error(f"Error generating blog post: {str(e)}")
+    except LLMResponseError as e:
+        logger.warning("blog generation failed: %s", e)
+        return jsonify({"error": str(e)}), 502
+    except Exception:
+        logger.exception("blog generation failed")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/generate_post', methods=['POST'])
-def generate_post():
+async def generate_post():
     try:
         # Ensure request is JSON
         if not request.is_json:
             return jsonify({"error": "Invalid JSON format"}), 400
 
-        raw_data = request.get_json()
+        raw_data = orjson.loads(await request.get_data())
         if not isinstance(raw_data, dict):
             return jsonify({"error": "Invalid JSON payload"}), 400
 
-        # Log raw request data for debugging
-        logging.info(f"Raw Request Data:\n{json.dumps(raw_data, indent=2)}")
+        # Log raw request data for debugging; %r is only formatted when DEBUG is enabled
+        logger.debug("Raw request data: %r", raw_data)
 
         # Sanitize the data
         cleaned_data = sanitize_json(raw_data)
 
         # Log sanitized data
-        logging.info(f"Sanitized Data:\n{json.dumps(cleaned_data, indent=2)}")
+        logger.debug("Sanitized data: %r", cleaned_data)
 
-        # Call the PostGenerator function with sanitized data
-        result = PostGenerator(cleaned_data)
+        # Required field validation
+        try:
+            payload = GenerateRequest.model_validate(cleaned_data).model_dump(by_alias=True)
+        except ValidationError as e:
+            return invalid_request_response(e)
+
+        # Stream partial posts as NDJSON when the client asks for it
+        if request.args.get("stream", "").lower() in ("1", "true"):
+            @stream_with_context
+            async def generate():
+                # Every stream ends with exactly one "final" or "error" record
+                try:
+                    async for record in PostStreamGenerator(payload):
+                        yield orjson.dumps(record) + b"\n"
+                except ValidationError as e:
+                    logger.warning("streamed social media post failed validation: %s", e)
+                    details = e.errors(include_url=False, include_context=False, include_input=False)
+                    yield orjson.dumps({
+                        "type": "error", "error": "Generated post failed validation", "details": details,
+                    }) + b"\n"
+                except LLMResponseError as e:
+                    logger.warning("social media post streaming failed: %s", e)
+                    yield orjson.dumps({"type": "error", "error": str(e)}) + b"\n"
+                except Exception:
+                    logger.exception("social media post streaming failed")
+                    yield orjson.dumps({"type": "error", "error": "Internal server error"}) + b"\n"
+
+            return Response(generate(), mimetype="application/x-ndjson")
+
+        # Call the PostGenerator function with validated data
+        result = await PostGenerator(payload)
         return jsonify(result)
 
     except json.JSONDecodeError as e:
-        logging.error(f"JSON Decoding Error: {str(e)}")
+        logger.warning("JSON decoding error: %s", e)
         return jsonify({"error": "Malformed JSON"}), 400
-    except Exception as e:
-        logging.error(f"Error generating social media post: {str(e)}")
+    except LLMResponseError as e:
+        logger.warning("social media post generation failed: %s", e)
+        return jsonify({"error": str(e)}), 502
+    except Exception:
+        logger.exception("social media post generation failed")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/generate_post_batch', methods=['POST'])
+async def generate_post_batch():
+    try:
+        # Ensure request is JSON
+        if not request.is_json:
+            return jsonify({"error": "Invalid JSON format"}), 400
+
+        raw_data = orjson.loads(await request.get_data())
+        if not isinstance(raw_data, list) or not raw_data or not all(isinstance(item, dict) for item in raw_data):
+            return jsonify({"error": "Expected a non-empty JSON array of objects"}), 400
+
+        # Validate every item so one response reports all the invalid ones
+        payloads, errors, error_indexes = [], [], []
+        for index, item in enumerate(raw_data):
+            try:
+                payloads.append(GenerateRequest.model_validate(sanitize_json(item)).model_dump(by_alias=True))
+            except ValidationError as e:
+                errors.append(e)
+                error_indexes.append(index)
+        if errors:
+            return invalid_request_response(*errors, indexes=error_indexes)
+
+        messages_list = [build_post_messages(PromptContext.from_request(payload)) for payload in payloads]
+        # Route each item the same way /generate_post would
+        models = [select_post_model(payload, messages) for payload, messages in zip(payloads, messages_list)]
+        batch_id = await LLM.submit_batch(response_model=SocialMediaPost, messages_list=messages_list, models=models)
+        return jsonify({"batch_id": batch_id}), 202
+
+    except json.JSONDecodeError as e:
+        logger.warning("JSON decoding error: %s", e)
+        return jsonify({"error": "Malformed JSON"}), 400
+    except Exception:
+        logger.exception("social media post batch submission failed")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/batch/<batch_id>', methods=['GET'])
+async def get_batch(batch_id: str):
+    try:
+        result = await LLM.retrieve_batch(batch_id, response_model=SocialMediaPost)
+        return jsonify({"batch_id": batch_id, **result})
+
+    except NotFoundError:
+        return jsonify({"error": f"Batch not found: {batch_id}"}), 404
+    except Exception:
+        logger.exception("batch retrieval failed for %s", batch_id)
         return jsonify({"error": "Internal server error"}), 500
 
 if __name__ == '__main__':
+    # Local runs only; in production start the app with `gunicorn app:app` (see gunicorn.conf.py)
     port = int(os.getenv('PORT', 5000))
-    logging.info(f'Starting Flask app on port {port}')
-    app.run(debug=True, host='0.0.0.0', port=port)
\ No newline at end of file
+    logger.info("Starting Quart app on port %s", port)
+    uvicorn.run(app, host='0.0.0.0', port=port, workers=1, loop='uvloop')
\ No newline at end of file
@@ -1,28 +1,45 @@
 from typing import Optional
-from pydantic_settings import BaseSettings
+from pydantic import Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from functools import lru_cache
 from dotenv import load_dotenv
-import os
 
 load_dotenv()
 
 
 class LLMProviderSettings(BaseSettings):
+    # .env is loaded into the environment by load_dotenv() above
+    model_config = SettingsConfigDict(frozen=True)
+
     temperature: float = 0.0
     max_tokens: Optional[int] = None
     max_retries: int = 5
+    max_concurrent_requests: int = 32
 
 
 class OpenAISettings(LLMProviderSettings):
-    api_key: str = os.getenv("OPENAI_API_KEY")
+    # Fields read OPENAI_<NAME> from the environment (api_key <- OPENAI_API_KEY) and can still be passed by name
+    model_config = SettingsConfigDict(env_prefix="OPENAI_")
+
+    # Required and non-empty, so a deploy without OPENAI_API_KEY fails at startup
+    api_key: str = Field(..., min_length=1)
     default_model: str = "gpt-4o"
+    small_model: str = "gpt-4o-mini"
+    max_retries: int = 2
+
+    @property
+    def allowed_models(self) -> frozenset:
+        """Models a request may pick through model_override."""
+        return frozenset({self.default_model, self.small_model})
 
 
 
 
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(frozen=True)
+
     app_name: str = "GenAI Project Template"
-    openai: OpenAISettings = OpenAISettings()
+    openai: OpenAISettings = Field(default_factory=OpenAISettings)
 
 
 
@@ -0,0 +1,14 @@
+# Production server settings: `gunicorn app:app` picks this file up automatically.
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+
+# Each worker runs one event loop (uvloop when installed) that keeps many LLM calls in flight
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+
+# Completions can take well over the 30 s default
+timeout = 120
+graceful_timeout = 30
+keepalive = 5